@@ -1,10 +1,27 @@
-from flask import Flask, request, jsonify
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled
+from fastapi import FastAPI, Depends, Query
+from arq import create_pool
+from arq.connections import RedisSettings
+from arq.constants import result_key_prefix
+from arq.jobs import Job, JobStatus
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from pydantic import BaseModel
+from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+from youtube_transcript_api.proxies import GenericProxyConfig
 import re
-import yt_dlp
+import json
 import os
+import sys
 import logging
 import asyncio
+import uuid
+import itertools
+import httpx
+import tiktoken
+import redis.asyncio as redis
+from contextlib import aclosing, asynccontextmanager
 from openai import OpenAI, AsyncOpenAI
 from openai import OpenAIError
 from auth import require_custom_authentication
@@ -12,130 +29,665 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-app = Flask(__name__)
-
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# OpenAI API client
+# Shared HTTP connection pool; HTTP/2 lets concurrent chunk requests multiplex over one connection
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+    http2=True,
+)
+
+# OpenAI API client; Whisper uploads of long segments can take minutes to answer.
+# The SDK is the only retry layer: it backs off exponentially and honours Retry-After on 429s.
+OPENAI_TIMEOUT = httpx.Timeout(600, connect=10)
+OPENAI_MAX_RETRIES = 4
 client = AsyncOpenAI(
     api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=http_client,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=OPENAI_MAX_RETRIES,
 )
 
-# Proxy setup for YouTube transcript API
+# Redis cache for raw transcripts and formatted results; also the Whisper job queue broker
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+redis_client = redis.Redis.from_url(REDIS_URL)
+CACHE_TTL = 86400
+
+# In-flight lock so concurrent requests for one video share a single OpenAI run
+LOCK_TTL = 600
+LOCK_POLL_INTERVAL = 0.5
+release_lock_script = redis_client.register_script(
+    "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+)
+
+# Bump when the formatting prompt changes so stale results are not served
+FORMAT_MODEL = "gpt-4o-mini"
+PROMPT_VERSION = "v1"
+OPENAI_ERROR_PREFIX = "OpenAI API error: "
+
+# Tokenizer for the formatting model, loaded once; chunks stay well under the context limit
+ENCODER = tiktoken.encoding_for_model(FORMAT_MODEL)
+CHUNK_TOKENS = 1024
+# Latin sentence ends need trailing whitespace; CJK ones (。！？) are usually not followed by any
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+|(?<=[。！？])\s*')
+
+# Cap in-flight OpenAI requests per process
+OPENAI_CONCURRENCY = 8
+openai_semaphore = asyncio.Semaphore(OPENAI_CONCURRENCY)
+
+# Proxy setup for YouTube transcript API; a bare host:port means an HTTP proxy
 proxy_address = os.environ.get("PROXY")
+if proxy_address and "://" not in proxy_address:
+    proxy_address = f"http://{proxy_address}"
+
+# One transcript client, so its requests session and connections are reused across requests
+youtube_transcript_api = YouTubeTranscriptApi(
+    proxy_config=GenericProxyConfig(http_url=proxy_address, https_url=proxy_address) if proxy_address else None,
+)
+CAPTION_LANGUAGES = ("en",)
 
 # Path to cookies file
 COOKIES_FILE = "cookies.txt"
 
+# ffmpeg filter dropping silent stretches longer than a second before Whisper
+SILENCE_FILTER = "silenceremove=stop_periods=-1:stop_duration=1:stop_threshold=-50dB"
+
+# Length of the audio segments transcribed concurrently by Whisper
+WHISPER_SEGMENT_SECONDS = 600
+
+# Audio is decoded to 16 kHz mono 16-bit PCM, the format Whisper works in
+SAMPLE_RATE = 16000
+SEGMENT_BYTES = WHISPER_SEGMENT_SECONDS * SAMPLE_RATE * 2
+
+# Segments end at the quietest 100 ms frame of their last 30 s, so cuts fall between words
+CUT_SEARCH_BYTES = 30 * SAMPLE_RATE * 2
+CUT_FRAME_BYTES = SAMPLE_RATE * 2 // 10
+
+# Compiled once at import rather than on every request
+YOUTUBE_ID_RE = re.compile(r'(?:v=|\/)([0-9A-Za-z_-]{11})')
+
+
+# Queue for Whisper jobs, processed by worker.py; connected on first use so the API starts without Redis
+JOB_QUEUE_SETTINGS = RedisSettings.from_dsn(REDIS_URL)
+JOB_QUEUE_SETTINGS.conn_retries = 1
+RESULT_MAX_WAIT = 60
+job_queue = None
+
+
+class AudioUnavailableError(Exception):
+    """Raised when the audio for the Whisper fallback cannot be downloaded."""
+
+
+async def warm_up():
+    """Exercises the shared singletons once so the first request doesn't pay for it."""
+    ENCODER.encode_ordinary("warm up")
+    try:
+        await redis_client.ping()  # Opens the first pooled connection
+    except redis.RedisError as e:
+        logger.warning(f"Redis unavailable at startup: {e}")
+    try:
+        await client.models.retrieve(FORMAT_MODEL)  # Pays the TLS handshake to OpenAI up front
+    except OpenAIError as e:
+        logger.warning(f"OpenAI unreachable at startup: {e}")
+
+
+async def get_job_queue():
+    """Returns the Whisper job queue, connecting if needed; None while Redis is unreachable."""
+    global job_queue
+    if job_queue is None:
+        try:
+            job_queue = await create_pool(JOB_QUEUE_SETTINGS)
+        except (OSError, redis.RedisError, asyncio.TimeoutError) as e:
+            logger.warning(f"Job queue unavailable: {e}")
+    return job_queue
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await get_job_queue()
+    await warm_up()
+    yield
+    if job_queue is not None:
+        await job_queue.aclose()
+    await http_client.aclose()
+    await redis_client.aclose()
+
+
+# Every endpoint requires authentication, so the check is registered once for the whole app.
+# App dependencies don't cover FastAPI's built-in docs routes, so those are turned off.
+app = FastAPI(
+    lifespan=lifespan,
+    dependencies=[Depends(require_custom_authentication)],
+    docs_url=None,
+    redoc_url=None,
+    openapi_url=None,
+)
+
+
+class TranscribeRequest(BaseModel):
+    url: str | None = None
+    stream: bool = False
+
+
+# Registered for Starlette's base class so routing 404/405s get the same shape as our own errors
+@app.exception_handler(StarletteHTTPException)
+async def http_exception_handler(request, exc):
+    """Keeps error responses in the {"error": ...} shape clients expect."""
+    return JSONResponse({"error": exc.detail}, status_code=exc.status_code, headers=getattr(exc, "headers", None))
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request, exc):
+    """Reports malformed requests in the same {"error": ...} shape, with the validation details."""
+    return JSONResponse({"error": "Invalid request", "details": jsonable_encoder(exc.errors())}, status_code=422)
+
+
+def result_cache_key(video_id):
+    return f"yt:{video_id}:{FORMAT_MODEL}:{PROMPT_VERSION}"
+
+
+def raw_cache_key(video_id):
+    return f"raw:{video_id}"
+
+
+async def cache_get(key):
+    """Reads a cached value, treating Redis errors as a miss."""
+    try:
+        value = await redis_client.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"Cache read failed for {key}: {e}")
+        return None
+    return value.decode() if value is not None else None
+
+
+async def cache_set(key, value):
+    """Stores a value in the cache, logging and ignoring Redis errors."""
+    try:
+        await redis_client.set(key, value, ex=CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Cache write failed for {key}: {e}")
+
+
+async def acquire_lock(key, token):
+    """Takes the in-flight lock for key; if Redis is unreachable, proceeds as the owner."""
+    try:
+        return bool(await redis_client.set(key, token, nx=True, ex=LOCK_TTL))
+    except redis.RedisError as e:
+        logger.warning(f"Lock acquire failed for {key}: {e}")
+        return True
+
+
+async def release_lock(key, token):
+    """Releases the lock only if this request still owns it."""
+    try:
+        await release_lock_script(keys=[key], args=[token])
+    except redis.RedisError as e:
+        logger.warning(f"Lock release failed for {key}: {e}")
+
+
+async def wait_for_result(video_id, lock_key, deadline):
+    """Waits for the lock holder to cache a result; returns None if it finishes without one or Redis fails."""
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        try:
+            locked = await redis_client.exists(lock_key)
+        except redis.RedisError as e:
+            logger.warning(f"Lock check failed for {lock_key}: {e}")
+            return None
+        # Read the cache after the lock, so a released lock means the result is already there
+        cached_result = await cache_get(result_cache_key(video_id))
+        if cached_result is not None or not locked:
+            return cached_result
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+    return None
+
 
 def get_youtube_id(url):
     """Extracts video ID from YouTube URL."""
-    video_id = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11}).*', url)
-    return video_id.group(1) if video_id else None
+    match = YOUTUBE_ID_RE.search(url)
+    return match.group(1) if match else None
 
 
 def process_transcript(video_id):
     """Retrieves transcript using YouTubeTranscriptAPI."""
     try:
-        transcript = YouTubeTranscriptApi.get_transcript(video_id, proxies={"http": proxy_address, "https": proxy_address})
-        full_text = ' '.join([entry['text'] for entry in transcript])
+        transcript = youtube_transcript_api.fetch(video_id, languages=CAPTION_LANGUAGES)
+        full_text = ' '.join(snippet.text for snippet in transcript)
         return full_text
-    except TranscriptsDisabled:
+    except (TranscriptsDisabled, NoTranscriptFound):
         logger.warning(f"Transcript unavailable for {video_id}, fallback to Whisper.")
         return None
 
 
-def download_audio(video_url):
-    """Downloads the audio using yt-dlp with cookies."""
-    output_path = "audio.mp3"
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': output_path,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'cookiefile': COOKIES_FILE,  # Use the cookies.txt file for authentication
-        'quiet': False
-    }
+def find_quiet_cut(pcm):
+    """Returns the byte offset of the quietest frame near the end of a full PCM segment."""
+    search_start = len(pcm) - CUT_SEARCH_BYTES
+    samples = memoryview(pcm)[search_start:].cast('h')
+    frame_samples = CUT_FRAME_BYTES // 2
+    energies = [
+        sum(map(abs, samples[i:i + frame_samples]))
+        for i in range(0, len(samples) - frame_samples + 1, frame_samples)
+    ]
+    quietest = min(range(len(energies)), key=energies.__getitem__)
+    return search_start + quietest * CUT_FRAME_BYTES + CUT_FRAME_BYTES // 2
 
+
+async def stream_audio_segments(video_url):
+    """Yields PCM segments of about WHISPER_SEGMENT_SECONDS of a video's audio while it is still downloading."""
+    # yt-dlp writes the audio stream to a pipe that ffmpeg decodes as it arrives
+    read_fd, write_fd = os.pipe()
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
-        return output_path
-    except Exception as e:
-        logger.error(f"Audio download failed: {e}")
-        return None
+        downloader = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'yt_dlp', '--quiet', '-f', 'bestaudio/best',
+            '--cookies', COOKIES_FILE,  # Use the cookies.txt file for authentication
+            '-o', '-', video_url,
+            stdout=write_fd,
+        )
+        try:
+            decoder = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+                # Whisper works on 16 kHz mono; also cut long silences so there is less to upload and transcribe
+                '-af', SILENCE_FILTER, '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', 'pipe:1',
+                stdin=read_fd,
+                stdout=asyncio.subprocess.PIPE,
+            )
+        except BaseException:
+            downloader.kill()
+            await downloader.wait()
+            raise
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+    try:
+        pending = b''
+        while True:
+            try:
+                pending += await decoder.stdout.readexactly(SEGMENT_BYTES - len(pending))
+            except asyncio.IncompleteReadError as e:
+                pending += e.partial
+                if pending:
+                    yield pending
+                break
+            # Carry the audio after the cut over into the next segment
+            cut = find_quiet_cut(pending)
+            yield pending[:cut]
+            pending = pending[cut:]
+
+        # A failure partway would otherwise pass off the segments read so far as the whole transcript
+        if await downloader.wait() != 0:
+            logger.error(f"Audio download failed for {video_url}")
+            raise AudioUnavailableError(video_url)
+        if await decoder.wait() != 0:
+            logger.error(f"Audio decoding failed for {video_url}")
+            raise AudioUnavailableError(video_url)
+    finally:
+        for process in (downloader, decoder):
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+async def encode_mp3(pcm):
+    """Encodes a PCM segment to mp3 in memory for upload."""
+    encoder = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-loglevel', 'error', '-f', 's16le', '-ar', str(SAMPLE_RATE), '-ac', '1', '-i', 'pipe:0',
+        '-b:a', '48k', '-f', 'mp3', 'pipe:1',
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+    mp3, _ = await encoder.communicate(pcm)
+    if encoder.returncode != 0 or not mp3:
+        logger.error(f"Audio encoding failed with exit code {encoder.returncode}")
+        raise AudioUnavailableError("mp3 encoding failed")
+    return mp3
+
+
+async def transcribe_audio_segment(index, pcm):
+    """Transcribes one audio segment with Whisper AI."""
+    mp3 = await encode_mp3(pcm)
+    async with openai_semaphore:
+        response = await client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(f"segment{index:03d}.mp3", mp3)
+        )
+    return response.text
+
+
+async def create_completion(chunk, **kwargs):
+    """Requests a formatting completion for a chunk; rate limits are retried by the client."""
+    return await client.chat.completions.create(
+        model=FORMAT_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that improves text formatting and adds punctuation."},
+            {"role": "user", "content": chunk}
+        ],
+        **kwargs
+    )
 
 
 async def process_chunk(chunk):
     """Processes a chunk of transcript text with OpenAI."""
+    async with openai_semaphore:
+        try:
+            response = await create_completion(chunk)
+            return response.choices[0].message.content
+        except OpenAIError as e:
+            return f"{OPENAI_ERROR_PREFIX}{str(e)}"
+
+
+async def stream_chunk(chunk, queue):
+    """Streams the formatted text of a chunk into queue as it is generated, ending with None.
+
+    A failure, including transport errors raised mid-stream, is put on the queue as the exception.
+    """
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that improves text formatting and adds punctuation."},
-                {"role": "user", "content": chunk}
-            ]
-        )
-        return response.choices[0].message.content
-    except OpenAIError as e:
-        return f"OpenAI API error: {str(e)}"
+        async with openai_semaphore:
+            stream = await create_completion(chunk, stream=True)
+            async for part in stream:
+                if part.choices and part.choices[0].delta.content:
+                    await queue.put(part.choices[0].delta.content)
+    except Exception as e:
+        logger.warning(f"Streaming chunk failed: {e!r}")
+        await queue.put(e)
+    finally:
+        await queue.put(None)
+
+
+def split_tokens(text, max_tokens):
+    """Splits text into windows of about max_tokens tokens, ignoring sentence boundaries.
+
+    Windows are cut at the start of a UTF-8 character, so none is split in two; the bytes moved
+    across a cut (at most 3, the rest of a character) can put a window up to 3 tokens over max_tokens.
+    """
+    data = text.encode()
+    tokens = ENCODER.encode_ordinary(text)  # Encode once, then cut at token byte offsets
+    token_ends = list(itertools.accumulate(len(token) for token in ENCODER.decode_tokens_bytes(tokens)))
+
+    chunks = []
+    start = 0
+    for i in range(max_tokens, len(token_ends) + max_tokens, max_tokens):
+        end = token_ends[min(i, len(token_ends)) - 1]
+        # Tokens can end mid-character; move the cut back to the character's first byte
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        if end > start:
+            chunks.append(data[start:end].decode())
+            start = end
+    return chunks
+
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS):
+    """Splits text into chunks of at most max_tokens tokens, breaking between sentences."""
+    # Sentences as (start, end) offsets, so packed chunks are plain slices of text
+    spans = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+
+    # One batched call counts tokens for every sentence
+    counts = [len(tokens) for tokens in ENCODER.encode_ordinary_batch([text[a:b] for a, b in spans])]
+
+    chunks = []
+    chunk_start = chunk_end = None
+    chunk_tokens = 0
+    for (start, end), count in zip(spans, counts):
+        count += 1  # Allow for the whitespace joining sentences
+        if chunk_start is not None and chunk_tokens + count > max_tokens:
+            chunks.append(text[chunk_start:chunk_end])
+            chunk_start = None
+            chunk_tokens = 0
+        if count > max_tokens:
+            # A single over-long sentence (e.g. unpunctuated auto captions) falls back to token windows
+            chunks.extend(split_tokens(text[start:end], max_tokens))
+            continue
+        if chunk_start is None:
+            chunk_start = start
+        chunk_end = end
+        chunk_tokens += count
+    if chunk_start is not None:
+        chunks.append(text[chunk_start:chunk_end])
+    return chunks
 
 
 async def improve_text_with_gpt4(text):
     """Enhances the transcript using OpenAI GPT-4o-mini."""
-    chunks = [text[i:i + 4096] for i in range(0, len(text), 4096)]  # Chunk to avoid token limit
+    chunks = chunk_text(text)
     tasks = [process_chunk(chunk) for chunk in chunks]
     improved_chunks = await asyncio.gather(*tasks)
     return ' '.join(improved_chunks)
 
 
-@app.route('/transcribe', methods=['POST'])
-@require_custom_authentication
-def transcribe():
+def sse_event(data, event=None):
+    """Formats a server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+async def stream_improved_text(video_id, transcript_text):
+    """Yields the formatted transcript as server-sent events, in order, while chunks are still generating."""
+    chunks = chunk_text(transcript_text)
+    queues = [asyncio.Queue() for _ in chunks]
+    tasks = [asyncio.create_task(stream_chunk(chunk, queue)) for chunk, queue in zip(chunks, queues)]
+
+    parts = []
+    try:
+        # All chunks generate concurrently; each queue is drained in turn to keep the text in order
+        for index, queue in enumerate(queues):
+            if index:
+                parts.append(' ')
+                yield sse_event({"delta": ' '})
+            while (delta := await queue.get()) is not None:
+                if isinstance(delta, Exception):
+                    # The transcript now has a hole in it; report that instead of completing or caching it
+                    error = f"{OPENAI_ERROR_PREFIX}{delta}" if isinstance(delta, OpenAIError) else "An unexpected error occurred"
+                    yield sse_event({"error": error}, event="error")
+                    return
+                parts.append(delta)
+                yield sse_event({"delta": delta})
+    finally:
+        for task in tasks:
+            task.cancel()  # Stop generating if the client went away or a chunk failed
+
+    await cache_set(result_cache_key(video_id), ''.join(parts))
+    yield sse_event({}, event="done")
+
+
+async def stream_cached_text(text):
+    """Yields an already formatted transcript as server-sent events."""
+    yield sse_event({"delta": text})
+    yield sse_event({}, event="done")
+
+
+async def improve_and_cache(video_id, transcript_text):
+    """Formats a raw transcript and caches the result."""
+    improved_text = await improve_text_with_gpt4(transcript_text)
+
+    # Don't pin a partially failed result in the cache
+    if OPENAI_ERROR_PREFIX not in improved_text:
+        await cache_set(result_cache_key(video_id), improved_text)
+    return improved_text
+
+
+async def transcribe_with_whisper(youtube_url, video_id):
+    """Transcribes a video with Whisper AI and formats it; runs on the worker."""
+    logger.info(f"Using Whisper AI for {video_id}")
+
+    tasks = []
+    try:
+        # Start transcribing each segment as soon as it is decoded, while the rest is still downloading
+        async with aclosing(stream_audio_segments(youtube_url)) as segments:
+            async for segment in segments:
+                tasks.append(asyncio.create_task(transcribe_audio_segment(len(tasks), segment)))
+        if not tasks:
+            raise AudioUnavailableError(video_id)
+        texts = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    transcript_text = ' '.join(texts)
+    await cache_set(raw_cache_key(video_id), transcript_text)
+    return await improve_and_cache(video_id, transcript_text)
+
+
+async def get_raw_transcript(video_id):
+    """Returns the raw transcript from the cache or YouTube captions, or None if there are none."""
+    # Only go to YouTube when no raw transcript is cached yet
+    transcript_text = await cache_get(raw_cache_key(video_id))
+    if not transcript_text:
+        # Try to get transcript; the library is blocking, so keep it off the event loop
+        transcript_text = await asyncio.to_thread(process_transcript, video_id)
+        if transcript_text:
+            await cache_set(raw_cache_key(video_id), transcript_text)
+    return transcript_text
+
+
+def queue_unavailable():
+    return JSONResponse({"error": "Whisper transcription is temporarily unavailable"}, status_code=503)
+
+
+async def clear_failed_job(queue, job_id):
+    """Drops the kept result of a finished job that failed, so the video can be retried."""
+    job = Job(job_id, queue)
+    if await job.status() != JobStatus.complete:
+        return False
+    info = await job.result_info()
+    if info is not None and info.success and OPENAI_ERROR_PREFIX not in info.result:
+        return False
+    await queue.delete(result_key_prefix + job_id)
+    return True
+
+
+async def enqueue_whisper(youtube_url, video_id):
+    """Hands a video without captions to the Whisper worker and tells the client to poll."""
+    queue = await get_job_queue()
+    if queue is None:
+        return queue_unavailable()
+
+    job_id = f"whisper:{video_id}"
+    # A fixed job id means concurrent requests for the same video share one job
+    job = await queue.enqueue_job('run_whisper', youtube_url, video_id, _job_id=job_id)
+    # arq keeps finished results for a while and refuses the id meanwhile; only a good result should stick
+    if job is None and await clear_failed_job(queue, job_id):
+        await queue.enqueue_job('run_whisper', youtube_url, video_id, _job_id=job_id)
+    return JSONResponse({"job_id": job_id}, status_code=202)
+
+
+async def build_result(youtube_url, video_id):
+    """Fetches and formats the transcript for a video that isn't cached yet."""
+    logger.info(f"Processing video: {video_id}")
+
+    transcript_text = await get_raw_transcript(video_id)
+
+    # If transcript unavailable, hand off to the Whisper worker
+    if not transcript_text:
+        return await enqueue_whisper(youtube_url, video_id)
+
+    # Improve transcript formatting
+    improved_text = await improve_and_cache(video_id, transcript_text)
+
+    return {"result": improved_text}
+
+
+async def build_stream(youtube_url, video_id):
+    """Like build_result, but streams the formatted transcript as it is generated."""
+    logger.info(f"Streaming video: {video_id}")
+
+    transcript_text = await get_raw_transcript(video_id)
+    if not transcript_text:
+        return await enqueue_whisper(youtube_url, video_id)
+
+    return StreamingResponse(stream_improved_text(video_id, transcript_text), media_type="text/event-stream")
+
+
+@app.post('/transcribe')
+async def transcribe(body: TranscribeRequest):
     """API endpoint for transcribing YouTube videos."""
-    youtube_url = request.json.get('url')
+    youtube_url = body.url
     if not youtube_url:
-        return jsonify({"error": "No YouTube URL provided"}), 400
+        return JSONResponse({"error": "No YouTube URL provided"}, status_code=400)
 
     video_id = get_youtube_id(youtube_url)
     if not video_id:
-        return jsonify({"error": "Invalid YouTube URL"}), 400
+        return JSONResponse({"error": "Invalid YouTube URL"}, status_code=400)
 
     try:
-        logger.info(f"Processing video: {video_id}")
-        
-        # Try to get transcript
-        transcript_text = process_transcript(video_id)
-
-        # If transcript unavailable, use Whisper AI
-        if not transcript_text:
-            logger.info(f"Using Whisper AI for {video_id}")
-            audio_file = download_audio(youtube_url)
-
-            if not audio_file:
-                return jsonify({"error": "Could not retrieve audio for Whisper AI."}), 500
-            
-            with open(audio_file, "rb") as file:
-                response = client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=file
-                )
-            transcript_text = response.text
-
-        # Improve transcript formatting
-        improved_text = asyncio.run(improve_text_with_gpt4(transcript_text))
-
-        return jsonify({"result": improved_text})
+        cached_result = await cache_get(result_cache_key(video_id))
+        if cached_result is not None:
+            logger.info(f"Cache hit for video: {video_id}")
+            if body.stream:
+                return StreamingResponse(stream_cached_text(cached_result), media_type="text/event-stream")
+            return {"result": cached_result}
+
+        # Streaming clients want tokens as they are generated, so they skip request coalescing
+        if body.stream:
+            return await build_stream(youtube_url, video_id)
+
+        lock_key = f"lock:{video_id}"
+        lock_token = uuid.uuid4().hex
+        # Bound the total wait, so a holder that keeps failing doesn't queue waiters up indefinitely
+        deadline = asyncio.get_running_loop().time() + LOCK_TTL
+        while not await acquire_lock(lock_key, lock_token):
+            if asyncio.get_running_loop().time() >= deadline:
+                return JSONResponse({"error": "Timed out waiting for this video to be processed"}, status_code=503)
+            # Another request is already processing this video; share its result
+            logger.info(f"Waiting for in-flight request for video: {video_id}")
+            cached_result = await wait_for_result(video_id, lock_key, deadline)
+            if cached_result is not None:
+                return {"result": cached_result}
+            # The holder finished without a result; one waiter takes over, the rest keep waiting
+
+        try:
+            # A holder may have cached the result and released the lock since the first cache check
+            cached_result = await cache_get(result_cache_key(video_id))
+            if cached_result is not None:
+                return {"result": cached_result}
+            return await build_result(youtube_url, video_id)
+        finally:
+            await release_lock(lock_key, lock_token)
 
     except Exception as e:
         logger.exception(f"An unexpected error occurred: {e}")
-        return jsonify({"error": "An unexpected error occurred"}), 500
+        return JSONResponse({"error": "An unexpected error occurred"}, status_code=500)
+
+
+@app.get('/result/{job_id}')
+async def result(job_id: str, wait: float = Query(0, ge=0, le=RESULT_MAX_WAIT)):
+    """Returns the result of a Whisper job, optionally long-polling up to `wait` seconds."""
+    queue = await get_job_queue()
+    if queue is None:
+        return queue_unavailable()
+    job = Job(job_id, queue)
+
+    if wait > 0:
+        try:
+            await job.result(timeout=wait)
+        except Exception:
+            pass  # Timeouts and job failures are reported from the job status below
+
+    status = await job.status()
+    if status == JobStatus.not_found:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    if status != JobStatus.complete:
+        return JSONResponse({"status": status.value}, status_code=202)
+
+    info = await job.result_info()
+    if info.success:
+        return {"result": info.result}
+    if isinstance(info.result, AudioUnavailableError):
+        return JSONResponse({"error": "Could not retrieve audio for Whisper AI."}, status_code=500)
+    logger.error(f"Whisper job {job_id} failed: {info.result!r}")
+    return JSONResponse({"error": "An unexpected error occurred"}, status_code=500)
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
+    import uvicorn
+
+    uvicorn.run("app:app", host='0.0.0.0', port=8080)
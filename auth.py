@@ -1,15 +1,18 @@
-from flask import request, jsonify
+from fastapi import Header, HTTPException
+from dotenv import load_dotenv
+import hmac
 import os
 
-def require_custom_authentication(func):
-    """Middleware for API authentication."""
-    def wrapper(*args, **kwargs):
-        secret_code = os.getenv("SECRET_CODE")
-        auth_header = request.headers.get("Authorization")
+load_dotenv()
 
-        if not auth_header or auth_header.split("Bearer ")[-1] != secret_code:
-            return jsonify({"error": "Unauthorized"}), 401
+# Read once at import; an unset secret rejects every request
+_SECRET = os.getenv("SECRET_CODE", "").encode()
+_PREFIX = b"Bearer "
 
-        return func(*args, **kwargs)
+def require_custom_authentication(authorization: str = Header(default="")):
+    """Dependency for API authentication."""
+    token = authorization.encode()
 
-    return wrapper
+    # compare_digest keeps the comparison constant-time
+    if not (_SECRET and token.startswith(_PREFIX) and hmac.compare_digest(token[len(_PREFIX):], _SECRET)):
+        raise HTTPException(status_code=401, detail="Unauthorized")
@@ -0,0 +1,49 @@
+import pytest
+
+from app import ENCODER, chunk_text, split_tokens
+
+ASCII = "The quick brown fox jumps over the lazy dog and keeps running down the road"
+CJK = "今日は晴れです明日は雨が降るでしょう東京の天気予報によると週末まで続きます"
+EMOJI = "Party 🎉 time 👨‍👩‍👧‍👦 family 🇯🇵 flag ✅ done 🎉🎉🎉"
+
+
+@pytest.mark.parametrize("text", [ASCII, CJK, EMOJI, ASCII + CJK + EMOJI])
+@pytest.mark.parametrize("max_tokens", [1, 2, 3, 4, 7])
+def test_split_tokens_keeps_characters_whole(text, max_tokens):
+    windows = split_tokens(text, max_tokens)
+
+    assert ''.join(windows) == text
+    assert all('�' not in window for window in windows)
+    # Cuts move back to a character start, carrying at most 3 bytes into the next window
+    assert all(len(ENCODER.encode_ordinary(window)) <= max_tokens + 3 for window in windows)
+
+
+def test_chunk_text_breaks_between_sentences():
+    sentences = [f"Sentence number {i} is here." for i in range(40)]
+    text = ' '.join(sentences)
+
+    chunks = chunk_text(text, max_tokens=40)
+
+    assert len(chunks) > 1
+    assert all(chunk.endswith('.') for chunk in chunks)
+    assert ' '.join(chunks) == text
+    assert all(len(ENCODER.encode_ordinary(chunk)) <= 40 for chunk in chunks)
+
+
+def test_chunk_text_breaks_after_cjk_terminators():
+    text = "今日は晴れです。明日は雨でしょう！週末はどうですか？" * 10
+
+    chunks = chunk_text(text, max_tokens=30)
+
+    assert len(chunks) > 1
+    assert all(chunk[-1] in "。！？" for chunk in chunks)
+    assert ''.join(chunks) == text
+
+
+@pytest.mark.parametrize("text", [ASCII * 20, CJK * 20, EMOJI * 20])
+def test_chunk_text_falls_back_to_windows_without_punctuation(text):
+    chunks = chunk_text(text, max_tokens=16)
+
+    assert len(chunks) > 1
+    assert ''.join(chunks) == text
+    assert all('�' not in chunk for chunk in chunks)
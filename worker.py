@@ -0,0 +1,20 @@
+from arq.connections import RedisSettings
+from app import REDIS_URL, http_client, redis_client, transcribe_with_whisper
+
+
+async def run_whisper(ctx, youtube_url, video_id):
+    """Runs the Whisper fallback for a video off the web process."""
+    return await transcribe_with_whisper(youtube_url, video_id)
+
+
+async def shutdown(ctx):
+    await http_client.aclose()
+    await redis_client.aclose()
+
+
+class WorkerSettings:
+    """arq settings; start with `arq worker.WorkerSettings`."""
+    functions = [run_whisper]
+    redis_settings = RedisSettings.from_dsn(REDIS_URL)
+    on_shutdown = shutdown
+    job_timeout = 3600  # Long videos can take a while to download and transcribe